@@ -1,11 +1,15 @@
 import os
 import asyncio
-import json
-import nest_asyncio
-from fastapi import FastAPI
-from fastapi.testclient import TestClient
+import orjson
+from fastapi import FastAPI, Response
+from fastapi.responses import ORJSONResponse
 from dotenv import load_dotenv
 
+try:
+    import uvloop
+except ImportError:  # uvloop does not support Windows
+    uvloop = None
+
 # Load environment variables from .env (HF_TOKEN, etc.)
 load_dotenv()
 
@@ -15,37 +19,41 @@ from orchestrator.models import (
     FullOrchestratorResponse,
     generate_suggestions,
 )
-from orchestrator.context import extract_context
+from orchestrator.context import extract_context_cached
+from orchestrator.llm import LLM_MODEL
 from orchestrator.tools import call_tool
 from orchestrator.params import extract_tool_params
 from orchestrator.session import init_session, _default_user, SESSIONS
 
-# Apply nest_asyncio for compatibility (needed for TestClient + asyncio)
-nest_asyncio.apply()
-
 # Create FastAPI app
-app = FastAPI(title="YoLearn AI Orchestrator", version="1.0")
+app = FastAPI(
+    title="YoLearn AI Orchestrator",
+    version="1.0",
+    default_response_class=ORJSONResponse,
+)
 
 
 @app.get("/health")
 def health_check():
     """Health check endpoint"""
-    return {"status": "healthy", "model": "deepseek-ai/DeepSeek-R1"}
+    return {"status": "healthy", "model": LLM_MODEL}
 
 
 @app.post("/api/orchestrate_full", response_model=FullOrchestratorResponse)
-async def orchestrate_full(req: OrchestratorRequest):
+async def orchestrate_full(req: OrchestratorRequest, response: Response):
     """Main orchestration endpoint"""
-    # Step 1: Set up session tracking
+    # Step 1: Set up session tracking; grab the history now, since the
+    # bounded session store may evict the entry while we await the LLM
     session_id = init_session(req.user_id, req.session_id)
+    chat_history = SESSIONS[session_id]["history"]
 
     # Step 2: Extract context using AI (or robust fallback)
-    ctx = extract_context(req.user_input)
+    ctx, cache_hit = await extract_context_cached(req.user_input)
+    response.headers["X-Cache-Hit"] = "1" if cache_hit else "0"
     intent, topic, emotion = ctx["intent"], ctx["topic"], ctx["emotional_state"]
 
-    # Step 3: Get user profile and history
-    user_profile = _default_user()
-    chat_history = SESSIONS[session_id]["history"]
+    # Step 3: Get user profile
+    user_profile = _default_user(req.user_id)
 
     # Step 4: Extract tool parameters (emotion-aware)
     tool_name, tool_params = extract_tool_params(
@@ -80,7 +88,7 @@ async def orchestrate_full(req: OrchestratorRequest):
 # Demo runner + Chat runner
 # -------------------------
 def _print_full_json(obj):
-    print(json.dumps(obj, indent=2, ensure_ascii=False))
+    print(orjson.dumps(obj, option=orjson.OPT_INDENT_2).decode())
 
 
 async def run_demo_tests():
@@ -88,8 +96,6 @@ async def run_demo_tests():
     print("🎓 YoLearn.ai Orchestrator Demo")
     print("=" * 50)
 
-    tc = TestClient(app)
-
     test_cases = [
         {
             "input": "I'm struggling with calculus derivatives and need practice problems",
@@ -108,14 +114,21 @@ async def run_demo_tests():
         },
     ]
 
-    for i, test_case in enumerate(test_cases, 1):
+    # The cases are independent, so overlap their LLM calls and print in order
+    responses = await asyncio.gather(*(
+        orchestrate_full(
+            OrchestratorRequest(user_input=test_case["input"], user_id=test_case["user_id"]),
+            Response(),
+        )
+        for test_case in test_cases
+    ))
+
+    for i, (test_case, resp) in enumerate(zip(test_cases, responses), 1):
         print(f"\n🧪 Test {i}: {test_case['description']}")
         print(f"📝 Input: {test_case['input']}")
         print("-" * 50)
 
-        payload = {"user_input": test_case["input"], "user_id": test_case["user_id"]}
-        resp = tc.post("/api/orchestrate_full", json=payload)
-        _print_full_json(resp.json())
+        _print_full_json(resp.model_dump(mode="json"))
         print("=" * 50)
 
 
@@ -137,10 +150,10 @@ async def chat_loop():
             break
 
         req = OrchestratorRequest(user_input=user_input, user_id=user_id, session_id=session_id)
-        resp: FullOrchestratorResponse = await orchestrate_full(req)
+        resp: FullOrchestratorResponse = await orchestrate_full(req, Response())
 
         # Print FULL JSON response (not a short sentence)
-        _print_full_json(resp.model_dump())
+        _print_full_json(resp.model_dump(mode="json"))
 
         # Keep session for continuity
         session_id = resp.session_id
@@ -154,6 +167,10 @@ if __name__ == "__main__":
     if not os.environ.get("HF_TOKEN"):
         print("⚠️  HF_TOKEN not found in environment; AI calls will use fallback extraction.")
 
+    # uvicorn already picks uvloop when installed; do the same for direct runs
+    if uvloop is not None:
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+
     if DEMO_MODE:
         asyncio.run(run_demo_tests())
     else:
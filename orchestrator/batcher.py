@@ -0,0 +1,73 @@
+"""Asynchronous micro-batching of concurrent requests"""
+
+import asyncio
+from typing import Any, Awaitable, Callable, List, Optional, Set
+
+class MicroBatcher:
+    """Collect items submitted within a short window and process them together.
+
+    A background worker drains the queue until it holds `max_batch_size`
+    items or `max_wait` seconds have passed since the first one arrived, then
+    hands the batch to `process_batch`. That callable returns one result per
+    item, in order; an exception instance in the list fails only its caller.
+    """
+
+    def __init__(
+        self,
+        process_batch: Callable[[List[Any]], Awaitable[List[Any]]],
+        max_batch_size: int = 8,
+        max_wait: float = 0.02,
+    ):
+        self.process_batch = process_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._inflight: Set[asyncio.Task] = set()
+
+    async def submit(self, item: Any) -> Any:
+        """Queue an item and wait for its result."""
+        loop = asyncio.get_running_loop()
+        # Queues and tasks belong to one event loop; rebind if it changed
+        if self._loop is not loop or self._worker is None or self._worker.done():
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._worker = loop.create_task(self._run())
+        future = loop.create_future()
+        self._queue.put_nowait((item, future))
+        return await future
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            # Dispatch without waiting so the next window starts collecting now
+            task = loop.create_task(self._dispatch(batch))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    async def _dispatch(self, batch: List[tuple]) -> None:
+        try:
+            results = await self.process_batch([item for item, _ in batch])
+            if len(results) != len(batch):
+                raise ValueError(f"Expected {len(batch)} results, got {len(results)}")
+        except Exception as e:
+            results = [e] * len(batch)
+
+        for (_, future), result in zip(batch, results):
+            if future.done():  # Caller was cancelled
+                continue
+            if isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
@@ -1,80 +1,131 @@
 # orchestrator/context.py
 
-import os
-import json
+import asyncio
 import re
-from typing import Dict
-from openai import OpenAI
+from typing import Any, Dict, FrozenSet, Iterator, List, Set, Tuple
+import orjson
+from cachetools import TTLCache
+from .batcher import MicroBatcher
+from .llm import LLM_MODEL, get_client as _get_client
+from .singleflight import SingleFlight
+
+# LLM results keyed by normalized input; chat turns repeat phrases often
+_CONTEXT_CACHE = TTLCache(maxsize=4096, ttl=15 * 60)
+
+def _normalize_input(user_input: str) -> str:
+    """Normalize case and whitespace so trivially different inputs share a cache key."""
+    return " ".join(user_input.lower().split())
+
+_CONTEXT_KEYS = ("intent", "topic", "emotional_state")
+
+def _has_context_keys(obj: Any) -> bool:
+    """Check that a parsed object carries every context field."""
+    return isinstance(obj, dict) and all(k in obj for k in _CONTEXT_KEYS)
+
+def _iter_json_objects(text: str) -> Iterator[str]:
+    """Yield each balanced {...} span in text, in order of its closing brace.
+    
+    Single O(N) pass with a stack of open braces; braces inside JSON strings
+    (including escaped quotes) do not count. Nested objects are yielded
+    before the object that contains them.
+    """
+    starts: List[int] = []
+    in_string = escaped = False
+    for i, ch in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = bool(starts)
+        elif ch == "{":
+            starts.append(i)
+        elif ch == "}" and starts:
+            yield text[starts.pop():i + 1]
 
 def extract_last_json(text: str) -> Dict[str, str]:
     """Extract the last valid JSON object from text."""
-    patterns = [
-        r'\{[^{}]*"intent"[^{}]*"topic"[^{}]*"emotional_state"[^{}]*\}',
-        r'\{[^{}]*"intent"[^{}]*\}',
-        r'\{.*?"intent".*?\}',
-    ]
-    
-    for pattern in patterns:
-        matches = re.findall(pattern, text, re.DOTALL)
-        for match in reversed(matches):
-            try:
-                parsed = json.loads(match)
-                if all(k in parsed for k in ("intent", "topic", "emotional_state")):
-                    return parsed
-            except:
-                continue
+    for candidate in reversed(list(_iter_json_objects(text))):
+        try:
+            parsed = orjson.loads(candidate)
+        except ValueError:
+            continue
+        if _has_context_keys(parsed):
+            return parsed
     
     raise ValueError("No valid JSON found")
 
-def manual_extraction(user_input: str) -> Dict[str, str]:
-    """Manual extraction as final fallback when LLM fails."""
-    ui = user_input.lower()
-    
-    # Determine intent
-    if any(word in ui for word in ["practice", "problems", "quiz", "test", "exercise", "advanced problems"]):
-        intent = "request_practice_problems"
-    elif any(word in ui for word in ["notes", "summary", "summarize"]):
-        intent = "notes"
-    else:
-        intent = "explanation"
+# Keyword groups for manual_extraction, in priority order within each category
+_INTENT_KEYWORDS = (
+    ("request_practice_problems", ("practice", "problems", "quiz", "test", "exercise", "advanced problems")),
+    ("notes", ("notes", "summary", "summarize")),
+)
+_TOPIC_KEYWORDS = (
+    ("calculus", ("calculus", "derivative", "derivatives", "integral", "limit")),
+    ("photosynthesis", ("photosynthesis", "photosyn")),
+    ("quantum_mechanics", ("quantum", "quantum mechanics", "mechanics")),
+    ("biology", ("biology", "bio")),
+    ("chemistry", ("chemistry", "chem")),
+    ("physics", ("physics", "phys")),
+    ("math", ("math", "mathematics")),
+    ("algebra", ("algebra",)),
+    ("geometry", ("geometry",)),
+)
+_EMOTION_KEYWORDS = (
+    ("frustrated", ("struggling", "confused", "hard", "difficult", "help")),
+    ("confident", ("confident", "easy", "understand", "know", "well")),
+)
+
+def _build_keyword_index() -> Tuple["re.Pattern[str]", Dict[str, FrozenSet[Tuple[str, str]]]]:
+    """Compile every keyword into one pattern mapped to its (category, label) hits."""
+    labels: Dict[str, Set[Tuple[str, str]]] = {}
+    for category, groups in (("intent", _INTENT_KEYWORDS), ("topic", _TOPIC_KEYWORDS), ("emotion", _EMOTION_KEYWORDS)):
+        for label, keywords in groups:
+            for keyword in keywords:
+                labels.setdefault(keyword, set()).add((category, label))
     
-    # Enhanced topic detection
-    topic = "general"
-    topics = {
-        "calculus": ["calculus", "derivative", "derivatives", "integral", "limit"],
-        "photosynthesis": ["photosynthesis", "photosyn"],
-        "quantum_mechanics": ["quantum", "quantum mechanics", "mechanics"],
-        "biology": ["biology", "bio"],
-        "chemistry": ["chemistry", "chem"],
-        "physics": ["physics", "phys"],
-        "math": ["math", "mathematics"],
-        "algebra": ["algebra"],
-        "geometry": ["geometry"],
+    # Each position reports only the longest keyword starting there, so it
+    # also carries the labels of any shorter keyword that is its prefix
+    merged = {
+        keyword: frozenset().union(*(hits for other, hits in labels.items() if keyword.startswith(other)))
+        for keyword in labels
     }
+    alternation = "|".join(re.escape(k) for k in sorted(labels, key=len, reverse=True))
+    # Zero-width lookahead lets matches overlap, like the substring scans it replaces
+    return re.compile(f"(?=({alternation}))"), merged
+
+_KEYWORD_RE, _KEYWORD_LABELS = _build_keyword_index()
+
+def _first_hit(hits: Set[Tuple[str, str]], category: str, groups: tuple, default: str) -> str:
+    """Return the highest-priority label of a category that was hit."""
+    for label, _ in groups:
+        if (category, label) in hits:
+            return label
+    return default
+
+def manual_extraction(user_input: str) -> Dict[str, str]:
+    """Manual extraction as final fallback when LLM fails."""
+    return _extract_lowered(user_input.lower())
+
+def _extract_lowered(ui: str) -> Dict[str, str]:
+    """Keyword extraction over input that is already lowercased."""
+    # One pass over the input collects every keyword hit
+    hits: Set[Tuple[str, str]] = set()
+    for match in _KEYWORD_RE.finditer(ui):
+        hits |= _KEYWORD_LABELS[match.group(1)]
     
-    for topic_name, keywords in topics.items():
-        if any(keyword in ui for keyword in keywords):
-            topic = topic_name
-            break
-    
-    # Determine emotional state
-    emotional_state = "neutral"
-    if any(word in ui for word in ["struggling", "confused", "hard", "difficult", "help"]):
-        emotional_state = "frustrated"
-    elif any(word in ui for word in ["confident", "easy", "understand", "know", "well"]):
-        emotional_state = "confident"
+    intent = _first_hit(hits, "intent", _INTENT_KEYWORDS, "explanation")
+    topic = _first_hit(hits, "topic", _TOPIC_KEYWORDS, "general")
+    emotional_state = _first_hit(hits, "emotion", _EMOTION_KEYWORDS, "neutral")
     
     return {"intent": intent, "topic": topic, "emotional_state": emotional_state}
 
-def extract_context(user_input: str) -> Dict[str, str]:
-    """Extract context with LLM first, then manual fallback."""
-    hf_token = os.environ.get("HF_TOKEN")
-    
-    if hf_token:
-        try:
-            client = OpenAI(base_url="https://router.huggingface.co/v1", api_key=hf_token)
-            
-            simple_prompt = f"""
+def _context_prompt(user_input: str) -> str:
+    """Build the context-extraction prompt for the LLM."""
+    return f"""
 Extract from: "{user_input}"
 
 Return only this JSON format:
@@ -84,26 +135,137 @@ Intent options: explanation, notes, request_practice_problems
 Topic: main subject (fix spelling)
 Emotional state: neutral, frustrated, confident, anxious
 """
-            
-            response = client.chat.completions.create(
-                model="deepseek-ai/DeepSeek-R1",
-                messages=[
-                    {"role": "system", "content": "Output only JSON. No other text."},
-                    {"role": "user", "content": simple_prompt}
-                ],
-                temperature=0,
-                max_tokens=100,
-            )
-            
-            resp_text = response.choices[0].message.content.strip()
-            context = extract_last_json(resp_text)
-            print(f"DEBUG: LLM extracted: {context}")
+
+# A context object is ~25 tokens; JSON mode means nothing else is generated
+_CONTEXT_MAX_TOKENS = 48
+
+async def _llm_extract(user_input: str) -> Dict[str, str]:
+    """Ask the LLM for the context of a single input; raises on failure."""
+    response = await _get_client().chat.completions.create(
+        model=LLM_MODEL,
+        messages=[
+            {"role": "system", "content": "Output only JSON. No other text."},
+            {"role": "user", "content": _context_prompt(user_input)}
+        ],
+        response_format={"type": "json_object"},
+        temperature=0,
+        max_tokens=_CONTEXT_MAX_TOKENS,
+    )
+    resp_text = response.choices[0].message.content.strip()
+    try:
+        context = orjson.loads(resp_text)
+        if _has_context_keys(context):
             return context
-            
+    except ValueError:
+        pass
+    # Providers that ignore response_format may still wrap the JSON in text
+    return extract_last_json(resp_text)
+
+def _batch_prompt(user_inputs: List[str]) -> str:
+    """Build one prompt that extracts context for several inputs at once."""
+    numbered = "\n".join(f'{i}) "{text}"' for i, text in enumerate(user_inputs, 1))
+    return f"""
+Extract from each numbered input below.
+
+Return only a JSON object whose "results" list has one object per input, in the same order:
+{{"results":[{{"intent":"explanation","topic":"calculus","emotional_state":"neutral"}}]}}
+
+Intent options: explanation, notes, request_practice_problems
+Topic: main subject (fix spelling)
+Emotional state: neutral, frustrated, confident, anxious
+
+Inputs:
+{numbered}
+"""
+
+def _is_batch_results(obj: Any, expected: int) -> bool:
+    """Check that a parsed object holds one context per batched input."""
+    if not isinstance(obj, dict):
+        return False
+    results = obj.get("results")
+    return isinstance(results, list) and len(results) == expected and all(_has_context_keys(r) for r in results)
+
+def _parse_batch_results(text: str, expected: int) -> List[Dict[str, str]]:
+    """Extract the batched results list, tolerating text around the JSON.
+    
+    Like the single-input path, providers that ignore response_format (or
+    emit <think> blocks) still get parsed: the last object carrying a
+    matching results list wins.
+    """
+    try:
+        parsed = orjson.loads(text)
+        if _is_batch_results(parsed, expected):
+            return parsed["results"]
+    except ValueError:
+        pass
+    for candidate in reversed(list(_iter_json_objects(text))):
+        try:
+            parsed = orjson.loads(candidate)
+        except ValueError:
+            continue
+        if _is_batch_results(parsed, expected):
+            return parsed["results"]
+    
+    raise ValueError("Batched response does not match inputs")
+
+async def _llm_extract_batch(user_inputs: List[str]) -> List[Any]:
+    """Extract context for a batch of inputs with a single LLM call.
+    
+    A batch of one uses the regular prompt. If the batched answer cannot be
+    split into one valid object per input, each input is retried on its own.
+    """
+    if len(user_inputs) == 1:
+        return [await _llm_extract(user_inputs[0])]
+    
+    try:
+        response = await _get_client().chat.completions.create(
+            model=LLM_MODEL,
+            messages=[
+                {"role": "system", "content": "Output only JSON. No other text."},
+                {"role": "user", "content": _batch_prompt(user_inputs)}
+            ],
+            response_format={"type": "json_object"},
+            temperature=0,
+            max_tokens=_CONTEXT_MAX_TOKENS * len(user_inputs),
+        )
+        return _parse_batch_results(response.choices[0].message.content, len(user_inputs))
+    except Exception as e:
+        print(f"Batched LLM extraction failed, retrying individually: {e}")
+        return await asyncio.gather(*(_llm_extract(u) for u in user_inputs), return_exceptions=True)
+
+# Coalesces context extractions arriving within 20 ms into one LLM request
+_BATCHER = MicroBatcher(_llm_extract_batch, max_batch_size=8, max_wait=0.02)
+
+def _cache_llm_context(key: str, context: Dict[str, str]) -> None:
+    print(f"DEBUG: LLM extracted: {context}")
+    # Only LLM results are cached; the manual fallback is cheap and
+    # should not pin a degraded answer after a transient failure
+    _CONTEXT_CACHE[key] = context
+
+# Concurrent misses for the same normalized input share one LLM call
+_CONTEXT_FLIGHT = SingleFlight(on_success=_cache_llm_context)
+
+async def extract_context_cached(user_input: str) -> Tuple[Dict[str, str], bool]:
+    """Extract context, also reporting whether it was served without a new LLM call."""
+    key = _normalize_input(user_input)
+    cached = _CONTEXT_CACHE.get(key)
+    if cached is not None:
+        return dict(cached), True
+    
+    if _get_client() is not None:
+        try:
+            context, shared = await _CONTEXT_FLIGHT.do(key, lambda: _BATCHER.submit(user_input))
+            return dict(context), shared
         except Exception as e:
             print(f"LLM extraction failed: {e}")
     
-    # Manual extraction fallback
-    context = manual_extraction(user_input)
+    # Manual extraction fallback; the cache key is already lowercased, and
+    # collapsing whitespace cannot change which keyword labels are hit
+    context = _extract_lowered(key)
     print(f"DEBUG: Manual extracted: {context}")
+    return context, False
+
+async def extract_context(user_input: str) -> Dict[str, str]:
+    """Extract context with LLM first, then manual fallback."""
+    context, _ = await extract_context_cached(user_input)
     return context
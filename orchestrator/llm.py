@@ -0,0 +1,32 @@
+"""Shared LLM client used by context extraction and the tools"""
+
+import os
+from typing import Optional
+import httpx
+from openai import AsyncOpenAI
+
+__all__ = ["LLM_MODEL", "get_client"]
+
+LLM_MODEL = "deepseek-ai/DeepSeek-R1"
+
+# One client for the whole process so every call reuses its connection pool
+_CLIENT: Optional[AsyncOpenAI] = None
+
+def get_client() -> Optional[AsyncOpenAI]:
+    """Return the shared client, creating it on first use once HF_TOKEN is set.
+    
+    Built lazily rather than at import so callers that load .env after
+    importing the package still get the LLM path.
+    """
+    global _CLIENT
+    if _CLIENT is None:
+        hf_token = os.environ.get("HF_TOKEN")
+        if hf_token:
+            _CLIENT = AsyncOpenAI(
+                base_url="https://router.huggingface.co/v1",
+                api_key=hf_token,
+                http_client=httpx.AsyncClient(
+                    limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+                ),
+            )
+    return _CLIENT
@@ -1,8 +1,7 @@
 """Enhanced Pydantic models with real tool schemas"""
 
-from pydantic import BaseModel, Field, validator
+from pydantic import BaseModel, ConfigDict, Field, PrivateAttr
 from typing import Optional, List, Dict, Any, Literal
-from enum import Enum
 
 class OrchestratorRequest(BaseModel):
     user_input: str
@@ -10,6 +9,8 @@ class OrchestratorRequest(BaseModel):
     session_id: Optional[str] = None
 
 class UserInfo(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
     user_id: str = Field(..., description="Unique identifier for the student")
     name: str = Field(..., description="Student's full name")
     grade_level: str = Field(..., description="Student's current grade level")
@@ -92,6 +93,8 @@ class ToolExecution(BaseModel):
     request_params: Dict[str, Any]
     raw_tool_response: Any
     formatted_response: str
+    # Set when a tool fell back to canned content; never serialized
+    _degraded: bool = PrivateAttr(default=False)
 
 class OrchestratorResponse(BaseModel):
     success: bool
@@ -106,32 +109,50 @@ class FullOrchestratorResponse(OrchestratorResponse):
     session_id: str
     next_actions: List[str]
 
+_INTENT_SUGGESTIONS = {
+    "practice": (
+        "Generate flashcards for practice",
+        "Provide concise notes summary",
+        "Ask for detailed concept explanation",
+    ),
+    "explanation": (
+        "Provide practice questions",
+        "Create summarized notes",
+        "Test understanding via flashcards",
+    ),
+    "notes": (
+        "Create flashcards from notes",
+        "Generate practice questions",
+        "Get concept explanations",
+    ),
+    "other": (),
+}
+_EMOTION_SUGGESTION = {
+    "confused": "Break content into simpler parts",
+    "anxious": "Break content into simpler parts",
+    "frustrated": "Break content into simpler parts",
+    "confident": "Try challenging problems",
+}
+
+# Every (intent bucket, emotion) combination, built once and capped at 3
+_SUGGESTIONS = {
+    (bucket, emotion): (base + ((extra,) if extra else ()))[:3]
+    for bucket, base in _INTENT_SUGGESTIONS.items()
+    for emotion, extra in list(_EMOTION_SUGGESTION.items()) + [(None, None)]
+}
+
+def _intent_bucket(intent: str) -> str:
+    """Map a free-form intent onto one of the suggestion table's buckets"""
+    if "practice" in intent or "problems" in intent:
+        return "practice"
+    if "explanation" in intent or "explain" in intent:
+        return "explanation"
+    if "note" in intent:
+        return "notes"
+    return "other"
+
 def generate_suggestions(intent: str, emotion: str) -> List[str]:
     """Generate adaptive suggestions based on intent and emotion"""
-    suggestions = []
-    
-    if "practice" in intent or "problems" in intent:
-        suggestions.extend([
-            "Generate flashcards for practice",
-            "Provide concise notes summary",
-            "Ask for detailed concept explanation"
-        ])
-    elif "explanation" in intent or "explain" in intent:
-        suggestions.extend([
-            "Provide practice questions",
-            "Create summarized notes",
-            "Test understanding via flashcards"
-        ])
-    elif "note" in intent:
-        suggestions.extend([
-            "Create flashcards from notes",
-            "Generate practice questions",
-            "Get concept explanations"
-        ])
-    
-    if emotion in ["confused", "anxious", "frustrated"]:
-        suggestions.append("Break content into simpler parts")
-    if emotion == "confident":
-        suggestions.append("Try challenging problems")
-    
-    return suggestions[:3]
+    bucket = _intent_bucket(intent)
+    suggestions = _SUGGESTIONS.get((bucket, emotion), _SUGGESTIONS[(bucket, None)])
+    return list(suggestions)
@@ -1,95 +1,146 @@
 # orchestrator/params.py
 
-from typing import Dict, Any, List, Optional, Tuple
+from functools import lru_cache
+from itertools import islice
+from types import MappingProxyType
+from typing import Dict, Any, Mapping, Sequence, Optional, Tuple
 from .tools import pick_tool_from_intent
-from .models import UserInfo, ChatMessage
+from .models import UserInfo
+
+# Per-tool defaults, built once and frozen so shared state cannot be mutated
+_TOOL_DEFAULTS = MappingProxyType({
+    "quiz_generator": MappingProxyType({"difficulty": "beginner", "question_type": "practice", "num_questions": 5}),
+    "flashcard_generator": MappingProxyType({"count": 5, "difficulty": "medium", "include_examples": True}),
+    "note_maker": MappingProxyType({"note_taking_style": "structured", "include_examples": True, "include_analogies": False}),
+    "concept_explainer": MappingProxyType({"desired_depth": "basic"}),
+})
+_NO_DEFAULTS = MappingProxyType({})
+
+def get_defaults(tool: str) -> Mapping[str, Any]:
+    """Return the read-only default settings for a tool (empty if it has none)"""
+    return _TOOL_DEFAULTS.get(tool, _NO_DEFAULTS)
+
+# Most recent chat turns forwarded to tools
+_HISTORY_WINDOW = 5
+
+# Emotions that override a tool's default difficulty
+_EMOTION_DIFFICULTY = {
+    "confused": "easy",
+    "anxious": "easy",
+    "frustrated": "easy",
+    "confident": "hard",
+}
+
+@lru_cache(maxsize=512)
+def _user_info_dict(items: Tuple[Tuple[str, Any], ...]) -> Dict[str, Any]:
+    """Validate and dump a user profile, once per distinct set of fields"""
+    return UserInfo(**dict(items)).model_dump()
+
+@lru_cache(maxsize=64)
+def _default_user_info_dict(emotion: str) -> Dict[str, Any]:
+    """Validate and dump the demo profile, once per emotion"""
+    return UserInfo(
+        user_id="student_demo",
+        name="Demo Student",
+        grade_level="10",
+        learning_style_summary="Structured learner",
+        emotional_state_summary=f"Currently feeling {emotion}",
+        mastery_level_summary="Level 5: Developing"
+    ).model_dump()
+
+def _extract_subject(topic: str) -> str:
+    """Return the leading word of a topic, splitting at most once"""
+    parts = topic.split(None, 1)
+    return parts[0] if parts else "general"
+
+# Per-tool parameter builders; all take the same shared inputs
+def _build_quiz_params(topic, subject, user_info_dict, chat_dicts, difficulty, defaults) -> Dict[str, Any]:
+    return {
+        "user_info": user_info_dict,
+        "topic": topic,
+        "difficulty": difficulty,
+        "question_type": defaults["question_type"],
+        "num_questions": defaults["num_questions"]
+    }
+
+def _build_flashcard_params(topic, subject, user_info_dict, chat_dicts, difficulty, defaults) -> Dict[str, Any]:
+    return {
+        "user_info": user_info_dict,
+        "topic": topic,
+        "count": defaults["count"],
+        "difficulty": difficulty,
+        "subject": subject,
+        "include_examples": defaults["include_examples"]
+    }
+
+def _build_note_params(topic, subject, user_info_dict, chat_dicts, difficulty, defaults) -> Dict[str, Any]:
+    return {
+        "user_info": user_info_dict,
+        "chat_history": chat_dicts,
+        "topic": topic,
+        "subject": subject,
+        "note_taking_style": defaults["note_taking_style"],
+        "include_examples": defaults["include_examples"],
+        "include_analogies": defaults["include_analogies"]
+    }
+
+def _build_concept_params(topic, subject, user_info_dict, chat_dicts, difficulty, defaults) -> Dict[str, Any]:
+    return {
+        "user_info": user_info_dict,
+        "chat_history": chat_dicts,
+        "concept_to_explain": topic,
+        "current_topic": subject,
+        "desired_depth": defaults["desired_depth"]
+    }
+
+def _build_fallback_params(topic, subject, user_info_dict, chat_dicts, difficulty, defaults) -> Dict[str, Any]:
+    return {"topic": topic}
+
+_BUILDERS = MappingProxyType({
+    "quiz_generator": _build_quiz_params,
+    "flashcard_generator": _build_flashcard_params,
+    "note_maker": _build_note_params,
+    "concept_explainer": _build_concept_params,
+})
 
 def extract_tool_params(
     intent: str,
     topic: str,
     emotion: str,
     user_info: Optional[Dict] = None,
-    chat_history: Optional[List] = None
+    chat_history: Optional[Sequence] = None
 ) -> Tuple[str, Dict[str, Any]]:
     """Extract and configure parameters for selected tool"""
 
     # Select tool
     tool = pick_tool_from_intent(intent)
+    subject = _extract_subject(topic)
 
-    # Build user_info
+    # Build user_info (validated once per distinct profile, copied per call)
     if user_info:
-        user_info_obj = UserInfo(**user_info)
+        user_info_dict = dict(_user_info_dict(tuple(sorted(user_info.items()))))
     else:
-        user_info_obj = UserInfo(
-            user_id="student_demo",
-            name="Demo Student",
-            grade_level="10",
-            learning_style_summary="Structured learner",
-            emotional_state_summary=f"Currently feeling {emotion}",
-            mastery_level_summary="Level 5: Developing"
-        )
+        user_info_dict = dict(_default_user_info_dict(emotion))
 
     # Convert chat history entries
-    chat_msgs = []
+    # Entries are written by the orchestrator itself; the tool request
+    # models validate them again at call_tool
+    chat_dicts = []
     if chat_history:
-        for entry in chat_history[-5:]:
-            chat_msgs.append(ChatMessage(role=entry["role"], content=entry["message"]))
+        # History may be a bounded deque, which does not support slicing
+        chat_dicts = [
+            {"role": entry["role"], "content": entry["message"]}
+            for entry in islice(chat_history, max(0, len(chat_history) - _HISTORY_WINDOW), None)
+        ]
 
     # Default settings
-    defaults = {
-        "quiz_generator": {"difficulty": "beginner", "question_type": "practice", "num_questions": 5},
-        "flashcard_generator": {"count": 5, "difficulty": "medium", "include_examples": True},
-        "note_maker": {"note_taking_style": "structured", "include_examples": True, "include_analogies": False},
-        "concept_explainer": {"desired_depth": "basic"}
-    }
-    tool_defaults = defaults.get(tool, {})
+    tool_defaults = get_defaults(tool)
 
     # Emotional adaptation
-    diff = tool_defaults.get("difficulty", "medium")
-    if emotion in ["confused", "anxious", "frustrated"]:
-        diff = "easy"
-    elif emotion == "confident":
-        diff = "hard"
+    diff = _EMOTION_DIFFICULTY.get(emotion, tool_defaults.get("difficulty", "medium"))
 
     # Build params per tool
-    if tool == "quiz_generator":
-        params = {
-            "user_info": user_info_obj.dict(),
-            "topic": topic,
-            "difficulty": diff,
-            "question_type": tool_defaults.get("question_type"),
-            "num_questions": tool_defaults.get("num_questions")
-        }
-    elif tool == "flashcard_generator":
-        count = tool_defaults.get("count", 5)
-        params = {
-            "user_info": user_info_obj.dict(),
-            "topic": topic,
-            "count": count,
-            "difficulty": diff,
-            "subject": topic.split()[0],
-            "include_examples": tool_defaults.get("include_examples", True)
-        }
-    elif tool == "note_maker":
-        params = {
-            "user_info": user_info_obj.dict(),
-            "chat_history": [msg.dict() for msg in chat_msgs],
-            "topic": topic,
-            "subject": topic.split()[0],
-            "note_taking_style": tool_defaults.get("note_taking_style"),
-            "include_examples": tool_defaults.get("include_examples", True),
-            "include_analogies": tool_defaults.get("include_analogies", False)
-        }
-    elif tool == "concept_explainer":
-        params = {
-            "user_info": user_info_obj.dict(),
-            "chat_history": [msg.dict() for msg in chat_msgs],
-            "concept_to_explain": topic,
-            "current_topic": topic.split()[0],
-            "desired_depth": tool_defaults.get("desired_depth", "basic")
-        }
-    else:
-        # Fallback
-        params = {"topic": topic}
+    builder = _BUILDERS.get(tool, _build_fallback_params)
+    params = builder(topic, subject, user_info_dict, chat_dicts, diff, tool_defaults)
 
     return tool, params
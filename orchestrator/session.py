@@ -1,28 +1,39 @@
 """Session management and user profiles"""
 
-from typing import Dict, Optional
-from datetime import datetime
+import time
+from collections import deque
+from functools import lru_cache
+from types import MappingProxyType
+from typing import Mapping, Optional
+from cachetools import TTLCache
 
-# In-memory session storage
-SESSIONS: Dict[str, Dict] = {}
+# In-memory session storage, bounded; sessions idle for an hour are evicted
+SESSIONS: TTLCache = TTLCache(maxsize=10_000, ttl=3600)
+
+# Turns kept per session; older messages are evicted on append
+HISTORY_MAXLEN = 20
 
 def init_session(user_id: str, session_id: Optional[str] = None) -> str:
     """Initialize or retrieve user session"""
     if not session_id:
-        session_id = f"{user_id}_{int(datetime.now().timestamp())}"
+        session_id = f"{user_id}_{time.time_ns() // 1_000_000_000}"
     
-    if session_id not in SESSIONS:
-        SESSIONS[session_id] = {"history": [], "profile": {}}
+    session = SESSIONS.get(session_id)
+    if session is None:
+        session = {"history": deque(maxlen=HISTORY_MAXLEN), "profile": {}}
+    # Reassigning restarts the TTL, so only idle sessions expire
+    SESSIONS[session_id] = session
     
     return session_id
 
-def _default_user() -> Dict:
-    """Generate default user profile"""
-    return {
-        "user_id": "student_demo",
+@lru_cache(maxsize=2048)
+def _default_user(user_id: str) -> Mapping[str, str]:
+    """Generate default user profile, built once per user and shared read-only"""
+    return MappingProxyType({
+        "user_id": user_id,
         "name": "Demo Student",
         "grade_level": "10",
         "learning_style_summary": "Structured learner",
         "emotional_state_summary": "Engaged",
         "mastery_level_summary": "Level 5: Developing"
-    }
+    })
@@ -0,0 +1,38 @@
+"""Deduplication of concurrent identical async calls"""
+
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+class SingleFlight:
+    """Run at most one call per key at a time; concurrent callers share it.
+
+    `on_success(key, result)` runs once per finished call that did not
+    raise, typically to store the result in a cache. The shared call is
+    shielded, so one cancelled caller does not cancel it for the others.
+    """
+
+    def __init__(self, on_success: Optional[Callable[[Hashable, Any], None]] = None):
+        self.on_success = on_success
+        self._pending: Dict[Hashable, asyncio.Future] = {}
+
+    async def do(self, key: Hashable, make_call: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """Await the call for key, starting it if needed; also report whether it was shared."""
+        task = self._pending.get(key)
+        shared = task is not None
+        if task is None:
+            task = asyncio.ensure_future(make_call())
+            self._pending[key] = task
+            task.add_done_callback(lambda t: self._finish(key, t))
+        return await asyncio.shield(task), shared
+
+    def clear(self) -> None:
+        """Forget in-flight calls; they keep running but are no longer shared."""
+        self._pending.clear()
+
+    def _finish(self, key: Hashable, task: asyncio.Future) -> None:
+        if self._pending.get(key) is task:
+            del self._pending[key]
+        if task.cancelled() or task.exception() is not None:
+            return
+        if self.on_success is not None:
+            self.on_success(key, task.result())
@@ -4,39 +4,97 @@ orchestrator/tools.py
 Educational tool implementations with LLM-powered content generation.
 """
 
-import os
+import inspect
+import json
 import re
-from typing import Dict, Any
-from openai import OpenAI
-from .models import NoteMakerRequest, ToolExecution, ConceptExplainerRequest
+from functools import lru_cache
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, Type, Union
+import orjson
+from cachetools import TTLCache
+from pydantic import BaseModel
+from .llm import LLM_MODEL, get_client as _get_client
+from .singleflight import SingleFlight
+from .models import (
+    NoteMakerRequest, ToolExecution, ConceptExplainerRequest, FlashcardGeneratorRequest
+)
 
+__all__ = [
+    "pick_tool_from_intent",
+    "clean_llm_response",
+    "call_concept_explainer",
+    "call_quiz_generator",
+    "call_note_maker",
+    "call_flashcard_generator",
+    "call_tool",
+]
+
+# Canonical intents from context extraction
+_EXACT_INTENT_TOOLS = {
+    "request_practice_problems": "quiz_generator",
+    "explanation": "concept_explainer",
+    "notes": "note_maker",
+}
+# Keyword fallbacks for free-form intents, checked in priority order
+_KEYWORD_INTENT_TOOLS = (
+    ("practice", "quiz_generator"),
+    ("quiz", "quiz_generator"),
+    ("problems", "quiz_generator"),
+    ("note", "note_maker"),
+    ("summary", "note_maker"),
+    ("explain", "concept_explainer"),
+)
+
+@lru_cache(maxsize=256)
 def pick_tool_from_intent(intent: str) -> str:
     """Select the appropriate educational tool based on the extracted intent."""
     i = intent.lower()
-    if i == "request_practice_problems":
-        return "quiz_generator"
-    if i == "explanation":
-        return "concept_explainer"
-    if i == "notes":
-        return "note_maker"
+    tool = _EXACT_INTENT_TOOLS.get(i)
+    if tool:
+        return tool
+    for keyword, tool in _KEYWORD_INTENT_TOOLS:
+        if keyword in i:
+            return tool
     return "quiz_generator"
 
+# Chain-of-thought blocks, then thinking-aloud phrases (to end of line) fused
+# into one pattern; both compiled once at import
+_THINK_BLOCK_RE = re.compile(r"<think>.*?</think>", re.DOTALL | re.IGNORECASE)
+_THINKING_PHRASE_RE = re.compile(r"(?:Okay, so|Let me|I need to|Wait|Maybe)[^\n]*", re.IGNORECASE)
+
 def clean_llm_response(text: str) -> str:
     """Remove chain-of-thought and clean LLM response."""
-    # Remove common thinking patterns
-    patterns_to_remove = [
-        r"<think>.*?</think>",
-        r"Okay, so.*?(?=\n|$)",
-        r"Let me.*?(?=\n|$)",
-        r"I need to.*?(?=\n|$)",
-        r"Wait.*?(?=\n|$)",
-        r"Maybe.*?(?=\n|$)",
-    ]
-    
-    for pattern in patterns_to_remove:
-        text = re.sub(pattern, "", text, flags=re.DOTALL | re.IGNORECASE)
-    
-    return text.strip()
+    return _THINKING_PHRASE_RE.sub("", _THINK_BLOCK_RE.sub("", text)).strip()
+
+# Cleaned LLM replies keyed by model, temperature and the tool inputs that
+# shape the prompt, so popular topics skip the round-trip
+_LLM_CACHE = TTLCache(maxsize=1024, ttl=15 * 60)
+
+async def _cached_completion(
+    cache_key: Tuple[Any, ...],
+    system_prompt: str,
+    user_prompt: str,
+    temperature: float,
+    max_tokens: int,
+) -> str:
+    """Run a chat completion, reusing the cleaned reply for identical inputs."""
+    key = (LLM_MODEL, temperature) + cache_key
+    content = _LLM_CACHE.get(key)
+    if content is None:
+        client = _get_client()
+        if client is None:
+            raise Exception("HF_TOKEN missing")
+        response = await client.chat.completions.create(
+            model=LLM_MODEL,
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_prompt}
+            ],
+            temperature=temperature,
+            max_tokens=max_tokens
+        )
+        content = clean_llm_response(response.choices[0].message.content)
+        _LLM_CACHE[key] = content
+    return content
 
 async def call_concept_explainer(request: ConceptExplainerRequest) -> ToolExecution:
     concept = request.concept_to_explain.replace("_", " ")
@@ -51,21 +109,15 @@ Focus on key concepts, processes, and real-world applications.
 Topic: {concept}
 """
     
-    hf_token = os.environ.get("HF_TOKEN")
+    degraded = False
     try:
-        if not hf_token:
-            raise Exception("HF_TOKEN missing")
-        client = OpenAI(base_url="https://router.huggingface.co/v1", api_key=hf_token)
-        response = client.chat.completions.create(
-            model="deepseek-ai/DeepSeek-R1",
-            messages=[
-                {"role": "system", "content": "You are a direct educational tutor. No internal thoughts."},
-                {"role": "user", "content": explanation_prompt}
-            ],
+        explanation = await _cached_completion(
+            ("concept_explainer", concept, depth),
+            "You are a direct educational tutor. No internal thoughts.",
+            explanation_prompt,
             temperature=0.5,
-            max_tokens=500
+            max_tokens=500,
         )
-        explanation = clean_llm_response(response.choices[0].message.content)
         
         raw = {
             "explanation": explanation,
@@ -75,7 +127,7 @@ Topic: {concept}
             "source_references": [f"Educational resources on {concept}"]
         }
         formatted = f"Generated {depth} explanation of {concept}"
-    except Exception as e:
+    except Exception:
         raw = {
             "explanation": f"A comprehensive explanation of {concept} covering its key principles, processes, and applications in an easy-to-understand format for grade 10 students.",
             "examples": [f"Example of {concept} in daily life"],
@@ -84,107 +136,136 @@ Topic: {concept}
             "source_references": [f"References for {concept}"]
         }
         formatted = f"Fallback explanation of {concept}"
+        degraded = True
     
-    return ToolExecution(
+    execution = ToolExecution(
         tool_name="concept_explainer",
-        request_params=request.dict(),
+        request_params=request.model_dump(),
         raw_tool_response=raw,
         formatted_response=formatted
     )
+    execution._degraded = degraded
+    return execution
+
+# Problem templates, one dict per question number
+_PHOTOSYNTHESIS_STEPS = (
+    "Identify the location of the reaction",
+    "List the inputs and outputs",
+    "Explain the overall significance"
+)
+
+def _calc_problem(i: int, difficulty: str) -> Dict[str, Any]:
+    return {
+        "question": f"Find the derivative of f(x) = x^{i+1} + {i}x",
+        "answer": f"f'(x) = {i+1}x^{i} + {i}",
+        "solution_steps": [
+            f"Apply power rule to x^{i+1}: {i+1}x^{i}",
+            f"Derivative of {i}x is {i}",
+            f"Combined result: f'(x) = {i+1}x^{i} + {i}"
+        ],
+        "difficulty": difficulty
+    }
+
+def _photosynthesis_problem(i: int, difficulty: str) -> Dict[str, Any]:
+    stage = "light-dependent" if i % 2 == 1 else "light-independent"
+    return {
+        "question": f"Explain what happens during the {stage} reactions of photosynthesis",
+        "answer": f"The {stage} reactions involve specific processes in photosynthesis",
+        "solution_steps": list(_PHOTOSYNTHESIS_STEPS),
+        "difficulty": difficulty
+    }
+
+def _advanced_problem(i: int, topic: str, difficulty: str) -> Dict[str, Any]:
+    return {
+        "question": f"Advanced problem {i} about {topic}",
+        "answer": f"Solution involves understanding key {topic} concepts",
+        "solution_steps": [
+            f"Analyze the {topic} problem",
+            f"Apply {topic} principles",
+            "Verify the solution"
+        ],
+        "difficulty": difficulty
+    }
+
+def _fallback_problem(i: int, topic: str, difficulty: str) -> Dict[str, Any]:
+    return {
+        "question": f"Practice problem {i} on {topic} ({difficulty} level)",
+        "answer": f"Solution for {topic} problem {i}",
+        "solution_steps": [f"Step 1: Apply {topic} concepts", "Step 2: Solve systematically"],
+        "difficulty": difficulty
+    }
+
+_TEMPLATED_TOPICS = {
+    "calculus": _calc_problem,
+    "photosynthesis": _photosynthesis_problem,
+}
+
+# One "Qn/An/Sn" block per problem, as requested by the quiz prompt
+_PROBLEM_RE = re.compile(r"^Q(\d+):[ \t]*(.+)\n+A\1:[ \t]*(.+)\n+S\1:[ \t]*(.+)$", re.MULTILINE)
+
+def _parse_problems(content: str, difficulty: str) -> List[Dict[str, Any]]:
+    """Parse problems from an LLM reply in the quiz prompt's format."""
+    return [
+        {
+            "question": question.strip(),
+            "answer": answer.strip(),
+            "solution_steps": [step.strip() for step in steps.split(";") if step.strip()],
+            "difficulty": difficulty
+        }
+        for _, question, answer, steps in _PROBLEM_RE.findall(content)
+    ]
 
 async def call_quiz_generator(params: Dict[str, Any]) -> ToolExecution:
     topic = params.get("topic", "general").replace("_", " ")
     difficulty = params.get("difficulty", "easy")
     num = params.get("num_questions", 5)
     
-    quiz_prompt = f"""
+    # Templated topics never used the LLM reply, so skip the round-trip
+    degraded = False
+    template = _TEMPLATED_TOPICS.get(topic)
+    if template is not None:
+        problems = [template(i, difficulty) for i in range(1, num + 1)]
+    else:
+        quiz_prompt = f"""
 Generate {num} {difficulty} practice problems about {topic} for grade 10 students.
 
-For each problem, provide:
-1. A specific question
-2. The correct answer
-3. Step-by-step solution
-
-Format clearly and avoid any internal thoughts.
+Use exactly this format for each problem n, one field per line, nothing else:
+Qn: <question>
+An: <correct answer>
+Sn: <step 1>; <step 2>; <step 3>
 
 Topic: {topic}
 Difficulty: {difficulty}
 """
-    
-    hf_token = os.environ.get("HF_TOKEN")
-    try:
-        if not hf_token:
-            raise Exception("HF_TOKEN missing")
-        client = OpenAI(base_url="https://router.huggingface.co/v1", api_key=hf_token)
-        response = client.chat.completions.create(
-            model="deepseek-ai/DeepSeek-R1",
-            messages=[
-                {"role": "system", "content": "You are a math/science problem generator. No internal thoughts."},
-                {"role": "user", "content": quiz_prompt}
-            ],
-            temperature=0.5,
-            max_tokens=800
-        )
-        content = clean_llm_response(response.choices[0].message.content)
-        
-        # Generate realistic problems
-        problems = []
-        for i in range(1, num + 1):
-            if topic == "calculus":
-                problems.append({
-                    "question": f"Find the derivative of f(x) = x^{i+1} + {i}x",
-                    "answer": f"f'(x) = {i+1}x^{i} + {i}",
-                    "solution_steps": [
-                        f"Apply power rule to x^{i+1}: {i+1}x^{i}",
-                        f"Derivative of {i}x is {i}",
-                        f"Combined result: f'(x) = {i+1}x^{i} + {i}"
-                    ],
-                    "difficulty": difficulty
-                })
-            elif topic == "photosynthesis":
-                problems.append({
-                    "question": f"Explain what happens during the {'light-dependent' if i%2==1 else 'light-independent'} reactions of photosynthesis",
-                    "answer": f"The {'light-dependent' if i%2==1 else 'light-independent'} reactions involve specific processes in photosynthesis",
-                    "solution_steps": [
-                        "Identify the location of the reaction",
-                        "List the inputs and outputs",
-                        "Explain the overall significance"
-                    ],
-                    "difficulty": difficulty
-                })
-            else:
-                problems.append({
-                    "question": f"Advanced problem {i} about {topic}",
-                    "answer": f"Solution involves understanding key {topic} concepts",
-                    "solution_steps": [
-                        f"Analyze the {topic} problem",
-                        f"Apply {topic} principles",
-                        f"Verify the solution"
-                    ],
-                    "difficulty": difficulty
-                })
-    except Exception as e:
-        # Enhanced fallback
-        problems = []
-        for i in range(1, num + 1):
-            problems.append({
-                "question": f"Practice problem {i} on {topic} ({difficulty} level)",
-                "answer": f"Solution for {topic} problem {i}",
-                "solution_steps": [f"Step 1: Apply {topic} concepts", f"Step 2: Solve systematically"],
-                "difficulty": difficulty
-            })
+        try:
+            content = await _cached_completion(
+                ("quiz_generator", topic, difficulty, num),
+                "You are a math/science problem generator. No internal thoughts.",
+                quiz_prompt,
+                temperature=0.5,
+                max_tokens=800,
+            )
+            problems = _parse_problems(content, difficulty)[:num]
+            # Pad with the generic template if the reply was short or off-format
+            problems += [_advanced_problem(i, topic, difficulty) for i in range(len(problems) + 1, num + 1)]
+        except Exception:
+            # Enhanced fallback
+            problems = [_fallback_problem(i, topic, difficulty) for i in range(1, num + 1)]
+            degraded = True
 
     raw = {"questions": problems, "topic": topic, "difficulty": difficulty}
     formatted = f"Generated {num} {difficulty} practice problems on {topic}"
     
-    return ToolExecution(
+    execution = ToolExecution(
         tool_name="quiz_generator",
         request_params=params,
         raw_tool_response=raw,
         formatted_response=formatted
     )
+    execution._degraded = degraded
+    return execution
 
-async def call_note_maker(request) -> ToolExecution:
+def call_note_maker(request: NoteMakerRequest) -> ToolExecution:
     topic = request.topic.replace("_", " ")
     
     raw = {
@@ -193,33 +274,115 @@ async def call_note_maker(request) -> ToolExecution:
     formatted = f"Generated structured notes on {topic}"
     return ToolExecution(
         tool_name="note_maker",
-        request_params=request.dict(),
+        request_params=request.model_dump(),
         raw_tool_response=raw,
         formatted_response=formatted
     )
 
-async def call_tool(tool_name: str, params: Dict[str, Any]) -> ToolExecution:
+def _flashcards(topic: str, difficulty: str, count: int, include_examples: bool) -> List[Dict[str, Any]]:
+    pretty = topic.title()
+    return [
+        {
+            "title": f"{pretty} card {i}",
+            "question": f"What is key idea {i} of {topic}?",
+            "answer": f"Key idea {i} of {topic} at {difficulty} level",
+            "example": f"Example of key idea {i} in {topic}" if include_examples else None
+        }
+        for i in range(1, count + 1)
+    ]
+
+def call_flashcard_generator(request: FlashcardGeneratorRequest) -> ToolExecution:
+    topic = request.topic.replace("_", " ")
+    difficulty = request.difficulty
+    
+    flashcards = _flashcards(topic, difficulty, request.count, request.include_examples)
+    raw = {
+        "flashcards": flashcards,
+        "topic": topic,
+        "adaptation_details": f"Adapted for {request.user_info.emotional_state_summary.lower()}",
+        "difficulty": difficulty
+    }
+    formatted = f"Generated {request.count} {difficulty} flashcards on {topic}"
+    return ToolExecution(
+        tool_name="flashcard_generator",
+        request_params=request.model_dump(),
+        raw_tool_response=raw,
+        formatted_response=formatted
+    )
+
+# Tool name -> (request model to validate params into, or None for raw params; handler).
+# Handlers that only fill templates are plain functions; LLM-backed ones are async
+_ToolHandler = Callable[[Any], Union[ToolExecution, Awaitable[ToolExecution]]]
+_DISPATCH: Dict[str, Tuple[Optional[Type[BaseModel]], _ToolHandler]] = {
+    "quiz_generator": (None, call_quiz_generator),
+    "concept_explainer": (ConceptExplainerRequest, call_concept_explainer),
+    "note_maker": (NoteMakerRequest, call_note_maker),
+    "flashcard_generator": (FlashcardGeneratorRequest, call_flashcard_generator),
+}
+
+# Finished tool results keyed by tool name and canonical params; sessions
+# repeat the same topic and settings often
+_TOOL_CACHE = TTLCache(maxsize=512, ttl=15 * 60)
+
+def _tool_cache_key(tool_name: str, params: Dict[str, Any]) -> bytes:
     try:
-        if tool_name == "quiz_generator":
-            return await call_quiz_generator(params)
-        elif tool_name == "concept_explainer":
-            req = ConceptExplainerRequest(**params)
-            return await call_concept_explainer(req)
-        elif tool_name == "note_maker":
-            req = NoteMakerRequest(**params)
-            return await call_note_maker(req)
-        
-        raw = {"message": "Tool not supported yet"}
-        return ToolExecution(
-            tool_name=tool_name,
-            request_params=params,
-            raw_tool_response=raw,
-            formatted_response="Generated fallback response"
-        )
+        canonical = orjson.dumps(params, default=str, option=orjson.OPT_SORT_KEYS)
+    except TypeError:
+        # orjson rejects a few shapes (non-str keys, ints over 64 bits) that json accepts
+        canonical = json.dumps(params, sort_keys=True, default=str).encode()
+    return tool_name.encode() + b"|" + canonical
+
+def _unsupported_tool(tool_name: str, params: Dict[str, Any]) -> ToolExecution:
+    raw = {"message": "Tool not supported yet"}
+    return ToolExecution(
+        tool_name=tool_name,
+        request_params=params,
+        raw_tool_response=raw,
+        formatted_response="Generated fallback response"
+    )
+
+def _tool_error(tool_name: str, params: Dict[str, Any], error: Exception) -> ToolExecution:
+    execution = ToolExecution(
+        tool_name=tool_name,
+        request_params=params,
+        raw_tool_response={"error": str(error)},
+        formatted_response=f"Error generating content for {params.get('topic','')}"
+    )
+    execution._degraded = True
+    return execution
+
+async def _run_tool(tool_name: str, params: Dict[str, Any]) -> ToolExecution:
+    entry = _DISPATCH.get(tool_name)
+    if entry is None:
+        return _unsupported_tool(tool_name, params)
+    model_cls, handler = entry
+    # Only validation and the handler itself can fail; nothing else is guarded
+    try:
+        result = handler(model_cls.model_validate(params) if model_cls else params)
+        if inspect.isawaitable(result):
+            result = await result
     except Exception as e:
-        return ToolExecution(
-            tool_name=tool_name,
-            request_params=params,
-            raw_tool_response={"error": str(e)},
-            formatted_response=f"Error generating content for {params.get('topic','')}"
-        )
+        return _tool_error(tool_name, params, e)
+    return result
+
+def _cache_tool_result(key: bytes, execution: ToolExecution) -> None:
+    # Store a private deep copy; the run's result still references the caller's params
+    if not execution._degraded:
+        _TOOL_CACHE[key] = execution.model_copy(deep=True)
+
+_TOOL_FLIGHT = SingleFlight(on_success=_cache_tool_result)
+
+async def call_tool(tool_name: str, params: Dict[str, Any]) -> ToolExecution:
+    """Run a tool, serving repeated (tool, params) pairs from the cache.
+    
+    Concurrent calls with the same pair share one run. Callers get a deep
+    copy, so mutating a result never reaches the cached entry. Errors and canned fallbacks are not cached,
+    so a transient LLM failure is not pinned.
+    """
+    key = _tool_cache_key(tool_name, params)
+    cached = _TOOL_CACHE.get(key)
+    if cached is not None:
+        return cached.model_copy(deep=True)
+    
+    execution, _ = await _TOOL_FLIGHT.do(key, lambda: _run_tool(tool_name, params))
+    return execution.model_copy(deep=True)
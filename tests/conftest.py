@@ -0,0 +1,40 @@
+"""Shared test fixtures"""
+
+from types import SimpleNamespace
+import pytest
+from orchestrator import context, tools
+
+def _clear_caches():
+    context._CONTEXT_CACHE.clear()
+    context._CONTEXT_FLIGHT.clear()
+    tools._LLM_CACHE.clear()
+    tools._TOOL_CACHE.clear()
+    tools._TOOL_FLIGHT.clear()
+
+@pytest.fixture(autouse=True)
+def reset_caches():
+    """Run every test against empty module-level caches"""
+    _clear_caches()
+    yield
+    _clear_caches()
+
+@pytest.fixture
+def fake_llm(monkeypatch):
+    """Route context and tool LLM calls to a fake client.
+
+    Call the fixture with the reply text, or with a function mapping the
+    request kwargs to the reply text; it returns the list of recorded
+    request kwargs.
+    """
+    def install(reply):
+        calls = []
+        async def create(**kwargs):
+            calls.append(kwargs)
+            content = reply(kwargs) if callable(reply) else reply
+            return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+        client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+        monkeypatch.setattr(context, "_get_client", lambda: client)
+        monkeypatch.setattr(tools, "_get_client", lambda: client)
+        return calls
+    return install
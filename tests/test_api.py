@@ -0,0 +1,39 @@
+"""API endpoint tests"""
+
+from fastapi.testclient import TestClient
+import app as app_module
+from app import app
+from orchestrator import context
+from orchestrator.session import SESSIONS
+
+client = TestClient(app)
+
+def test_health():
+    """Test health endpoint"""
+    response = client.get("/health")
+    
+    assert response.status_code == 200
+    assert response.json()["status"] == "healthy"
+
+def test_orchestrate_full_cache_header(monkeypatch):
+    """Test orchestration reports context cache status"""
+    monkeypatch.setattr(context, "_get_client", lambda: None)  # Keep the test off the network
+    payload = {"user_input": "I need notes on algebra", "user_id": "api_test"}
+    response = client.post("/api/orchestrate_full", json=payload)
+    
+    assert response.status_code == 200
+    assert response.headers["X-Cache-Hit"] == "0"
+    assert response.json()["success"] is True
+
+def test_orchestrate_full_survives_session_eviction(monkeypatch):
+    """Test a session evicted while context extraction awaits does not fail the request"""
+    async def evicting_extract(user_input):
+        SESSIONS.clear()
+        return {"intent": "notes", "topic": "algebra", "emotional_state": "neutral"}, False
+    
+    monkeypatch.setattr(app_module, "extract_context_cached", evicting_extract)
+    payload = {"user_input": "I need notes on algebra", "user_id": "evict_test"}
+    response = client.post("/api/orchestrate_full", json=payload)
+    
+    assert response.status_code == 200
+    assert response.json()["tool_execution"]["tool_name"] == "note_maker"
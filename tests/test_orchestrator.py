@@ -1,14 +1,19 @@
 """Orchestrator module tests"""
 
+import asyncio
 import pytest
-from orchestrator.context import extract_context
-from orchestrator.tools import pick_tool_from_intent
-from orchestrator.params import extract_tool_params
+from orchestrator import context, tools
+from orchestrator.batcher import MicroBatcher
+from orchestrator.context import extract_context, extract_context_cached, extract_last_json
+from orchestrator.models import ToolExecution
+from orchestrator.tools import pick_tool_from_intent, call_tool, call_quiz_generator
+from orchestrator.params import extract_tool_params, get_defaults
+from orchestrator.session import init_session, SESSIONS, HISTORY_MAXLEN
 
 def test_context_extraction():
     """Test context analysis"""
     # This will use the fallback since we don't have real API key in tests
-    result = extract_context("I need help with math")
+    result = asyncio.run(extract_context("I need help with math"))
     
     assert "intent" in result
     assert "topic" in result
@@ -19,6 +24,9 @@ def test_tool_selection():
     assert pick_tool_from_intent("I need practice problems") == "quiz_generator"
     assert pick_tool_from_intent("Explain this concept") == "concept_explainer"
     assert pick_tool_from_intent("Make notes") == "note_maker"
+    assert pick_tool_from_intent("quiz") == "quiz_generator"
+    assert pick_tool_from_intent("explain the notes") == "note_maker"  # Keyword priority, not position
+    assert pick_tool_from_intent("random gibberish") == "quiz_generator"  # Default
 
 def test_parameter_extraction():
     """Test parameter extraction"""
@@ -27,3 +35,285 @@ def test_parameter_extraction():
     assert tool == "quiz_generator"
     assert params["difficulty"] == "easy"  # Frustrated emotion should make it easy
     assert params["topic"] == "math"
+
+def test_context_cache_hit():
+    """Test cached LLM context is served for equivalent inputs"""
+    
+    cached = {"intent": "notes", "topic": "photosynthesis", "emotional_state": "neutral"}
+    context._CONTEXT_CACHE[context._normalize_input("Summarize  Photosynthesis")] = cached
+    result, hit = asyncio.run(extract_context_cached("summarize photosynthesis "))
+    
+    assert hit
+    assert result == cached
+    assert result is not cached  # Callers get a copy of the cached entry
+
+def test_context_concurrent_misses_share_llm_call(monkeypatch):
+    """Test concurrent identical misses await a single LLM call"""
+    
+    calls = []
+    async def fake_llm_extract(user_input):
+        calls.append(user_input)
+        await asyncio.sleep(0.01)
+        return {"intent": "explanation", "topic": "calculus", "emotional_state": "neutral"}
+    
+    monkeypatch.setattr(context, "_get_client", lambda: object())
+    monkeypatch.setattr(context, "_llm_extract", fake_llm_extract)
+    
+    async def burst():
+        return await asyncio.gather(*(extract_context_cached("Explain calculus") for _ in range(3)))
+    
+    results = asyncio.run(burst())
+    
+    assert len(calls) == 1
+    assert [hit for _, hit in results] == [False, True, True]
+    assert all(ctx["topic"] == "calculus" for ctx, _ in results)
+
+def test_micro_batcher_groups_concurrent_items():
+    """Test concurrent submissions are processed as one batch"""
+    
+    batches = []
+    async def process(items):
+        batches.append(items)
+        return [ValueError("bad") if item < 0 else item * 2 for item in items]
+    
+    batcher = MicroBatcher(process, max_batch_size=8, max_wait=0.01)
+    
+    async def burst():
+        return await asyncio.gather(*(batcher.submit(i) for i in (1, 2, -1)), return_exceptions=True)
+    
+    results = asyncio.run(burst())
+    
+    assert batches == [[1, 2, -1]]
+    assert results[:2] == [2, 4]
+    assert isinstance(results[2], ValueError)
+
+def test_extract_last_json_balanced_scan():
+    """Test JSON extraction from noisy LLM output"""
+    
+    text = (
+        '<think>Maybe {"intent": "notes"} fits, or {"note": "a } in a string"}</think>\n'
+        '{"intent": "explanation", "topic": "calculus", "emotional_state": "neutral", '
+        '"meta": {"source": "llm"}}'
+    )
+    
+    result = extract_last_json(text)
+    
+    assert result["intent"] == "explanation"
+    assert result["meta"] == {"source": "llm"}
+
+def test_session_history_is_bounded():
+    """Test session history evicts old turns and still feeds params"""
+    
+    session_id = init_session("history_test", "history_test_session")
+    history = SESSIONS[session_id]["history"]
+    for i in range(HISTORY_MAXLEN + 5):
+        history.append({"role": "user", "message": f"turn {i}"})
+    
+    tool, params = extract_tool_params("notes", "math", "neutral", chat_history=history)
+    
+    assert len(history) == HISTORY_MAXLEN
+    assert [m["content"] for m in params["chat_history"]][-1] == f"turn {HISTORY_MAXLEN + 4}"
+    assert len(params["chat_history"]) == 5
+
+def test_llm_extract_uses_json_mode(fake_llm):
+    """Test the LLM call requests JSON mode and parses the reply directly"""
+    requests = fake_llm('{"intent": "notes", "topic": "biology", "emotional_state": "anxious"}')
+    
+    result = asyncio.run(context._llm_extract("notes on biology please"))
+    
+    assert result["topic"] == "biology"
+    assert requests[0]["response_format"] == {"type": "json_object"}
+    assert requests[0]["max_tokens"] == 48
+
+def test_extract_last_json_nested_object():
+    """Test a context object nested in a wrapper is still found"""
+    
+    text = 'Answer: {"result": {"intent": "notes", "topic": "algebra", "emotional_state": "neutral"}}'
+    
+    assert extract_last_json(text)["topic"] == "algebra"
+
+def test_parameter_extraction_subject():
+    """Test subject is the leading topic word, with a fallback for blank topics"""
+    _, params = extract_tool_params("notes", "organic chemistry", "neutral")
+    _, blank = extract_tool_params("notes", "", "neutral")
+    
+    assert params["subject"] == "organic"
+    assert blank["subject"] == "general"
+
+def test_tool_llm_replies_are_cached(fake_llm):
+    """Test identical tool inputs reuse the cached LLM reply"""
+    calls = fake_llm("<think>hmm</think>Photosynthesis turns light into sugar.")
+    _, params = extract_tool_params("explanation", "photosynthesis", "neutral")
+    
+    first = asyncio.run(call_tool("concept_explainer", params))
+    second = asyncio.run(call_tool("concept_explainer", params))
+    
+    assert len(calls) == 1
+    assert first.raw_tool_response["explanation"] == "Photosynthesis turns light into sugar."
+    assert second.raw_tool_response == first.raw_tool_response
+
+def test_sessions_are_bounded_and_reused():
+    """Test the session store is bounded and init_session keeps existing history"""
+    
+    session_id = init_session("ttl_test", "ttl_test_session")
+    SESSIONS[session_id]["history"].append({"role": "user", "message": "hi"})
+    
+    assert init_session("ttl_test", session_id) == session_id
+    assert len(SESSIONS[session_id]["history"]) == 1
+    assert SESSIONS.maxsize == 10_000
+
+def test_flashcard_generator():
+    """Test flashcard tool builds one card per requested count"""
+    params = {
+        "user_info": {
+            "user_id": "flashcard_test",
+            "name": "Test Student",
+            "grade_level": "10",
+            "learning_style_summary": "Visual learner",
+            "emotional_state_summary": "Focused",
+            "mastery_level_summary": "Level 4: Building"
+        },
+        "topic": "photosynthesis",
+        "count": 3,
+        "difficulty": "medium",
+        "subject": "biology",
+        "include_examples": False
+    }
+    result = asyncio.run(call_tool("flashcard_generator", params))
+    flashcards = result.raw_tool_response["flashcards"]
+    
+    assert result.tool_name == "flashcard_generator"
+    assert len(flashcards) == 3
+    assert all(card["example"] is None for card in flashcards)
+    assert result.raw_tool_response["difficulty"] == "medium"
+
+def test_quiz_generator_templates_and_parsing(fake_llm):
+    """Test templated topics skip the LLM and other topics parse its reply"""
+    calls = fake_llm("Q1: What is 2x + 3 = 7?\nA1: x = 2\nS1: Subtract 3; Divide by 2")
+    
+    calculus = asyncio.run(call_quiz_generator({"topic": "calculus", "difficulty": "easy", "num_questions": 2}))
+    assert calls == []
+    assert calculus.raw_tool_response["questions"][0]["question"].startswith("Find the derivative")
+    
+    algebra = asyncio.run(call_quiz_generator({"topic": "algebra", "difficulty": "easy", "num_questions": 2}))
+    questions = algebra.raw_tool_response["questions"]
+    assert len(calls) == 1
+    assert questions[0] == {
+        "question": "What is 2x + 3 = 7?",
+        "answer": "x = 2",
+        "solution_steps": ["Subtract 3", "Divide by 2"],
+        "difficulty": "easy"
+    }
+    assert questions[1]["question"] == "Advanced problem 2 about algebra"
+
+def test_call_tool_caches_results_but_not_errors():
+    """Test repeated tool calls hit the cache and failed calls do not"""
+    
+    params = {"topic": "calculus", "difficulty": "easy", "num_questions": 2}
+    first = asyncio.run(call_tool("quiz_generator", params))
+    second = asyncio.run(call_tool("quiz_generator", params))
+    assert second == first
+    assert second is not first
+    assert len(tools._TOOL_CACHE) == 1
+    
+    failed = asyncio.run(call_tool("note_maker", {"topic": "calculus"}))
+    assert "error" in failed.raw_tool_response
+    assert len(tools._TOOL_CACHE) == 1
+
+def test_call_tool_cache_hits_are_isolated_from_callers():
+    """Test mutating a returned result does not change later cache hits"""
+    params = {"topic": "photosynthesis", "difficulty": "easy", "num_questions": 2}
+    caller_params = dict(params)
+    first = asyncio.run(call_tool("quiz_generator", caller_params))
+    caller_params["difficulty"] = "HACKED"
+    first.raw_tool_response["questions"][0]["solution_steps"].clear()
+    first.raw_tool_response["questions"].clear()
+    first.request_params["topic"] = "HACKED"
+    
+    second = asyncio.run(call_tool("quiz_generator", params))
+    second.raw_tool_response["questions"][0]["question"] = "X"
+    third = asyncio.run(call_tool("quiz_generator", params))
+    
+    assert len(tools._TOOL_CACHE) == 1
+    assert len(third.raw_tool_response["questions"]) == 2
+    assert third.raw_tool_response["questions"][0]["question"] != "X"
+    assert len(third.raw_tool_response["questions"][0]["solution_steps"]) == 3
+    assert third.request_params == params
+
+def test_call_tool_concurrent_duplicates_share_one_run(monkeypatch):
+    """Test concurrent identical tool calls run the handler once"""
+    
+    calls = []
+    async def handler(params):
+        calls.append(params)
+        await asyncio.sleep(0.01)
+        return ToolExecution(
+            tool_name="echo", request_params=params,
+            raw_tool_response={}, formatted_response="done"
+        )
+    
+    monkeypatch.setitem(tools._DISPATCH, "echo", (None, handler))
+    
+    async def run():
+        return await asyncio.gather(*(call_tool("echo", {"topic": "x"}) for _ in range(5)))
+    
+    results = asyncio.run(run())
+    
+    assert len(calls) == 1
+    assert len({id(r) for r in results}) == 5
+    assert all(r.formatted_response == "done" for r in results)
+
+def test_tool_defaults_are_read_only():
+    """Test shared tool defaults cannot be mutated by callers"""
+    
+    defaults = get_defaults("flashcard_generator")
+    assert defaults["count"] == 5
+    assert {**defaults, "count": 10}["count"] == 10
+    with pytest.raises(TypeError):
+        defaults["count"] = 10
+    assert get_defaults("unknown_tool") == {}
+
+def test_template_results_are_built_per_call():
+    """Test templated problems are fresh objects on every call"""
+    params = {"topic": "photosynthesis", "difficulty": "easy", "num_questions": 2}
+    first = asyncio.run(call_quiz_generator(params))
+    first.raw_tool_response["questions"][0]["question"] = "X"
+    first.raw_tool_response["questions"][0]["solution_steps"].clear()
+    
+    second = asyncio.run(call_quiz_generator(params))
+    
+    assert second.raw_tool_response["questions"][0]["question"] != "X"
+    assert len(second.raw_tool_response["questions"][0]["solution_steps"]) == 3
+
+def _context_json(topic):
+    return f'{{"intent": "notes", "topic": "{topic}", "emotional_state": "neutral"}}'
+
+def test_llm_extract_batch_splits_wrapped_reply(fake_llm):
+    """Test a batched reply wrapped in reasoning text is split per input"""
+    reply = (
+        '<think>Maybe {"results": []} would do</think>\n'
+        f'Here you go: {{"results": [{_context_json("algebra")}, {_context_json("biology")}]}}'
+    )
+    calls = fake_llm(reply)
+    
+    results = asyncio.run(context._llm_extract_batch(["notes on algebra", "notes on biology"]))
+    
+    assert len(calls) == 1
+    assert [r["topic"] for r in results] == ["algebra", "biology"]
+
+def test_llm_extract_batch_falls_back_per_item(fake_llm):
+    """Test a mismatched batch retries each input, failing only bad items"""
+    def reply(kwargs):
+        prompt = kwargs["messages"][1]["content"]
+        if "Inputs:" in prompt:
+            return f'{{"results": [{_context_json("algebra")}]}}'  # One result for two inputs
+        if "algebra" in prompt:
+            return _context_json("algebra")
+        return "no json here"
+    calls = fake_llm(reply)
+    
+    results = asyncio.run(context._llm_extract_batch(["notes on algebra", "notes on chemistry"]))
+    
+    assert len(calls) == 3
+    assert results[0]["topic"] == "algebra"
+    assert isinstance(results[1], ValueError)